@@ -4,16 +4,22 @@ Fetches ALL competitions & seasons (male + female) from StatsBomb open data
 and processes them into a dashboard-ready players.json.
 
 Data Source: StatsBomb Open Data (all available competitions & seasons)
-Output: data/players.json
+Output: data/players.json (+ data/players.parquet)
 """
 
-import json
+import argparse
+import functools
+import hashlib
 import os
+import shutil
 import sys
 import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+import numpy as np
+import orjson
 import pandas as pd
 from statsbombpy import sb
 
@@ -31,7 +37,131 @@ except Exception:
 MIN_MINUTES = 450         # Minimum minutes to qualify (5 full matches)
 OUTPUT_DIR = Path(__file__).resolve().parent.parent / "data"
 CACHE_DIR = OUTPUT_DIR / "cache"
+EVENTS_SCHEMA_VERSION = 3  # Bump to invalidate cached per-match event files
+EVENTS_CACHE_DIR = CACHE_DIR / f"events_v{EVENTS_SCHEMA_VERSION}"
+STAGE_CACHE_DIR = CACHE_DIR / f"stages_v{EVENTS_SCHEMA_VERSION}"
+STAGES = ("events", "minutes", "metrics")  # Cached pipeline stages, in run order
 OUTPUT_FILE = OUTPUT_DIR / "players.json"
+OUTPUT_PARQUET = OUTPUT_DIR / "players.parquet"  # Same records, for fast downstream reloads
+OUTPUT_SIGNATURE = OUTPUT_DIR / "players.sig"    # Input hash the current players.json was built from
+FETCH_WORKERS = 16        # Concurrent event downloads (keep modest to stay polite to the CDN)
+
+# Event columns used downstream, in a fixed order; everything else is dropped right after fetch
+EVENT_COLUMNS = (
+    "minute", "type", "player", "player_id", "position",
+    "shot_outcome", "shot_statsbomb_xg",
+    "pass_outcome", "pass_end_location", "pass_goal_assist", "pass_shot_assist",
+    "dribble_outcome", "counterpress", "duel_type", "duel_outcome",
+    "location", "carry_end_location", "substitution_replacement",
+)
+
+# Low-cardinality string columns stored as categoricals (cheap equality filters)
+CATEGORICAL_COLUMNS = (
+    "type", "player", "position", "pass_outcome",
+    "shot_outcome", "duel_type", "dribble_outcome",
+)
+
+# Remaining free-text columns used downstream, kept as Arrow-backed strings
+ARROW_STRING_COLUMNS = ("duel_outcome", "substitution_replacement")
+
+# StatsBomb duel_type / duel_outcome values counted as aerial duels and wins
+AERIAL_DUEL_TYPES = ("Aerial Lost", "Aerial Won")
+WON_DUEL_OUTCOMES = ("Won", "Success", "Success In Play", "Success Out")
+
+# StatsBomb position names -> simplified dashboard position (unknown names default to MF)
+POSITION_GROUPS = {
+    "Goalkeeper": "GK",
+    "Right Back": "DF", "Right Center Back": "DF", "Center Back": "DF",
+    "Left Center Back": "DF", "Left Back": "DF",
+    "Right Wing Back": "DF", "Left Wing Back": "DF",
+    "Right Defensive Midfield": "MF", "Center Defensive Midfield": "MF", "Left Defensive Midfield": "MF",
+    "Right Midfield": "MF", "Right Center Midfield": "MF", "Center Midfield": "MF",
+    "Left Center Midfield": "MF", "Left Midfield": "MF",
+    "Right Attacking Midfield": "MF", "Center Attacking Midfield": "MF", "Left Attacking Midfield": "MF",
+    "Right Wing": "FW", "Left Wing": "FW",
+    "Right Center Forward": "FW", "Center Forward": "FW", "Left Center Forward": "FW",
+    "Striker": "FW", "Secondary Striker": "FW",
+}
+
+# Per-event classification codes (see classify_events)
+EVENT_OTHER = 0
+EVENT_SHOT, EVENT_GOAL = 1, 2
+EVENT_PASS, EVENT_PASS_COMPLETE = 10, 11
+EVENT_DRIBBLE_COMPLETE = 20
+EVENT_PRESSURE, EVENT_COUNTERPRESS = 30, 31
+EVENT_AERIAL, EVENT_AERIAL_WON = 40, 41
+EVENT_CARRY = 50
+
+
+def write_json(path, payload):
+    """Serialise payload to an indented UTF-8 JSON file using orjson."""
+    path.write_bytes(orjson.dumps(payload, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+
+
+def stage_cache(name):
+    """
+    Cache a pipeline stage's DataFrame result as parquet in
+    STAGE_CACHE_DIR/<cache_key>/<name>.parquet.
+    The wrapped function accepts two extra keywords: `cache_key` (None disables
+    caching) and `refresh` (recompute and overwrite the cached frame).
+    Empty results and frames flagged with `attrs["skipped_matches"]` are not
+    cached, so failed or partial fetches are retried on the next run.
+    Starting a new key directory removes the stale ones left behind by earlier
+    keys of the same competition/season.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, cache_key=None, refresh=False, **kwargs):
+            if cache_key is None:
+                return func(*args, **kwargs)
+
+            path = STAGE_CACHE_DIR / str(cache_key) / f"{name}.parquet"
+            if path.exists() and not refresh:
+                return pd.read_parquet(path)
+
+            result = func(*args, **kwargs)
+            if result.empty or result.attrs.get("skipped_matches", 0):
+                return result
+            try:
+                if not path.parent.exists():
+                    prefix = str(cache_key).rsplit("_", 1)[0]
+                    for stale in STAGE_CACHE_DIR.glob(f"{prefix}_*"):
+                        shutil.rmtree(stale, ignore_errors=True)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix(".parquet.tmp")
+                result.to_parquet(tmp_path, compression="snappy")
+                tmp_path.replace(path)
+            except Exception as e:
+                print(f"    [!] Could not cache {name} stage: {e}")
+            return result
+        return wrapper
+    return decorator
+
+
+def competition_cache_key(comp_row, *extra):
+    """
+    Cache key for one competition/season: its ids plus a short hash of StatsBomb's
+    last-updated stamp and any extra inputs the cached data depends on.
+    """
+    parts = [str(comp_row.get("match_updated", "")), *map(str, extra)]
+    digest = hashlib.blake2b("|".join(parts).encode(), digest_size=6).hexdigest()
+    return f"{int(comp_row['competition_id'])}_{int(comp_row['season_id'])}_{digest}"
+
+
+def results_cache_key(comp_row):
+    """Key for a competition's exported records, which also depend on the thresholds."""
+    return competition_cache_key(comp_row, MIN_MINUTES, EVENTS_SCHEMA_VERSION)
+
+
+def input_signature(comps):
+    """
+    Hash of every per-competition results cache key, so players.json is only
+    reported up to date when each competition's cached records match the
+    current inputs (StatsBomb update stamps, MIN_MINUTES, events schema).
+    Pipeline code changes are not tracked; rebuild those with --refresh.
+    """
+    keys = sorted(results_cache_key(row) for _, row in comps.iterrows())
+    return hashlib.blake2b(orjson.dumps(keys)).hexdigest()
 
 
 def fetch_all_competitions():
@@ -49,24 +179,88 @@ def fetch_matches(competition_id, season_id):
     return matches
 
 
-def fetch_all_events(matches):
-    """Fetch event-level data for every match. Returns a single concatenated DataFrame."""
-    all_events = []
-    for idx, match_id in enumerate(matches["match_id"]):
-        try:
-            events = sb.events(match_id=match_id)
-            events["match_id"] = match_id
-            all_events.append(events)
-        except Exception as e:
-            print(f"         [!] Skipped match {match_id}: {e}")
-        if (idx + 1) % 50 == 0:
-            print(f"         ... processed {idx + 1}/{len(matches)} matches")
+def load_events_cached(match_id, last_updated=None, redownload=False):
+    """
+    Load events for a single match, using the on-disk parquet cache when present.
+    Cache files are keyed on the match's StatsBomb `last_updated` stamp, so
+    republished matches are downloaded again and replace their stale file.
+    Events are projected onto EVENT_COLUMNS (missing ones filled with NaN) so every
+    match shares one fixed schema, both in memory and in the cache.
+    Freshly downloaded matches are written back to the cache for the next run;
+    `redownload` skips the cache read and replaces the file.
+    """
+    stamp = hashlib.blake2b(str(last_updated).encode(), digest_size=6).hexdigest()
+    path = EVENTS_CACHE_DIR / f"{match_id}_{stamp}.parquet"
+    if path.exists() and not redownload:
+        return pd.read_parquet(path)
+
+    events = sb.events(match_id=match_id)
+    events = events.reindex(columns=list(EVENT_COLUMNS))
+    try:
+        EVENTS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".parquet.tmp")
+        events.to_parquet(tmp_path, compression="snappy")
+        tmp_path.replace(path)
+        # Drop files cached under this match's previous stamps (or the unstamped layout)
+        (EVENTS_CACHE_DIR / f"{match_id}.parquet").unlink(missing_ok=True)
+        for old in EVENTS_CACHE_DIR.glob(f"{match_id}_*.parquet"):
+            if old != path:
+                old.unlink(missing_ok=True)
+    except Exception as e:
+        print(f"         [!] Could not cache match {match_id}: {e}")
+    return events
+
+
+@stage_cache("events")
+def fetch_all_events(matches, redownload=False):
+    """
+    Fetch event-level data for every match. Returns a single concatenated DataFrame.
+    Downloads run concurrently on a thread pool since the work is network-bound;
+    matches already in the parquet cache are read from disk instead, unless
+    `redownload` is set.
+    The number of matches that failed to load is reported in attrs["skipped_matches"].
+    """
+    match_ids = list(matches["match_id"])
+    if "last_updated" in matches.columns:
+        stamps = dict(zip(match_ids, matches["last_updated"]))
+    else:
+        stamps = {}
+    fetched = {}
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as ex:
+        futures = {
+            ex.submit(load_events_cached, match_id, stamps.get(match_id), redownload): match_id
+            for match_id in match_ids
+        }
+        for idx, fut in enumerate(as_completed(futures)):
+            match_id = futures[fut]
+            try:
+                events = fut.result()
+                events["match_id"] = match_id
+                fetched[match_id] = events
+            except Exception as e:
+                print(f"         [!] Skipped match {match_id}: {e}")
+            if (idx + 1) % 50 == 0:
+                print(f"         ... processed {idx + 1}/{len(match_ids)} matches")
+    # Concatenate in match order so the output does not depend on completion order
+    all_events = [fetched[match_id] for match_id in match_ids if match_id in fetched]
+    skipped = len(match_ids) - len(all_events)
     if not all_events:
-        return pd.DataFrame()
-    events_df = pd.concat(all_events, ignore_index=True)
+        events_df = pd.DataFrame()
+        events_df.attrs["skipped_matches"] = skipped
+        return events_df
+    events_df = pd.concat(all_events, ignore_index=True, sort=False)
+    for col in CATEGORICAL_COLUMNS:
+        if col in events_df.columns:
+            events_df[col] = events_df[col].astype("category")
+    for col in ARROW_STRING_COLUMNS:
+        if col in events_df.columns:
+            events_df[col] = events_df[col].astype("string[pyarrow]")
+    events_df["event_class"] = classify_events(events_df)
+    events_df.attrs["skipped_matches"] = skipped
     return events_df
 
 
+@stage_cache("minutes")
 def calculate_minutes(events_df, matches):
     """
     Estimate minutes played per player.
@@ -87,58 +281,56 @@ def calculate_minutes(events_df, matches):
     player_minutes = player_events.merge(match_durations, on="match_id", how="left")
 
     # Substitution adjustments
-    subs = events_df[events_df["type"] == "Substitution"].copy()
+    sub_cols = [c for c in ("match_id", "player_id", "minute", "substitution_replacement")
+                if c in events_df.columns]
+    subs = events_df.loc[events_df["type"] == "Substitution", sub_cols]
     if not subs.empty:
         # Player subbed OFF: played from 0 to sub minute
-        subs_off = subs[["match_id", "player", "player_id", "minute"]].copy()
-        subs_off = subs_off.rename(columns={"minute": "sub_off_minute"})
+        subs_off = subs[["match_id", "player_id", "minute"]].rename(
+            columns={"minute": "sub_off_minute"}
+        )
 
-        # Player subbed ON: played from sub minute to end
+        # Player subbed ON: played from sub minute to end.
+        # Replacements are given by name, so resolve them to player_id within
+        # the same match (names are not unique across a season) and keep the
+        # minutes joins on integer keys.
         if "substitution_replacement" in subs.columns:
-            subs_on = subs[["match_id", "substitution_replacement", "minute"]].copy()
-            subs_on = subs_on.rename(columns={
-                "substitution_replacement": "player",
-                "minute": "sub_on_minute"
-            })
+            match_players = player_events[["match_id", "player", "player_id"]].astype({"player": str})
+            replacements = subs[["match_id", "substitution_replacement", "minute"]].dropna(
+                subset=["substitution_replacement"]
+            )
+            subs_on = (
+                replacements.astype({"substitution_replacement": str})
+                .merge(match_players, left_on=["match_id", "substitution_replacement"],
+                       right_on=["match_id", "player"])
+                [["match_id", "player_id", "minute"]]
+                .rename(columns={"minute": "sub_on_minute"})
+            )
         else:
             subs_on = pd.DataFrame()
 
         # Merge sub off times
-        player_minutes = player_minutes.merge(
-            subs_off[["match_id", "player_id", "sub_off_minute"]],
-            on=["match_id", "player_id"],
-            how="left"
-        )
+        player_minutes = player_minutes.merge(subs_off, on=["match_id", "player_id"], how="left")
 
         # Merge sub on times
         if not subs_on.empty:
-            player_minutes = player_minutes.merge(
-                subs_on[["match_id", "player", "sub_on_minute"]],
-                on=["match_id", "player"],
-                how="left"
-            )
+            player_minutes = player_minutes.merge(subs_on, on=["match_id", "player_id"], how="left")
         else:
             player_minutes["sub_on_minute"] = float("nan")
 
         # Calculate actual minutes per match
-        player_minutes["minutes"] = player_minutes.apply(
-            lambda row: (
-                row["sub_off_minute"]
-                if pd.notna(row.get("sub_off_minute"))
-                else (
-                    row["match_duration"] - row["sub_on_minute"]
-                    if pd.notna(row.get("sub_on_minute"))
-                    else row["match_duration"]
-                )
-            ),
-            axis=1,
+        off = player_minutes["sub_off_minute"].to_numpy(dtype=float, na_value=np.nan)
+        on = player_minutes["sub_on_minute"].to_numpy(dtype=float, na_value=np.nan)
+        dur = player_minutes["match_duration"].to_numpy(dtype=float, na_value=np.nan)
+        player_minutes["minutes"] = np.where(
+            ~np.isnan(off), off, np.where(~np.isnan(on), dur - on, dur)
         )
     else:
         player_minutes["minutes"] = player_minutes["match_duration"]
 
     # Sum across all matches
     total_minutes = (
-        player_minutes.groupby(["player", "player_id"])["minutes"]
+        player_minutes.groupby(["player", "player_id"], observed=True)["minutes"]
         .sum()
         .reset_index()
         .rename(columns={"minutes": "minutes_played"})
@@ -147,118 +339,177 @@ def calculate_minutes(events_df, matches):
     return total_minutes
 
 
+def location_xy(locations):
+    """Stack a Series of StatsBomb [x, y(, z)] locations into an (N, 2) float array."""
+    return np.asarray(locations.tolist(), dtype=float)[:, :2]
+
+
+def event_column(events_df, name):
+    """Return an event column, or an all-NaN Series if this competition lacks it."""
+    if name in events_df.columns:
+        return events_df[name]
+    return pd.Series(np.nan, index=events_df.index, dtype=object)
+
+
+def classify_events(events_df):
+    """
+    Classify every event into one int8 EVENT_* code in a single pass over the
+    type/outcome columns, so metric extraction only needs integer compares.
+    More specific classes (e.g. goal) take precedence over general ones (shot).
+    """
+    type_mask = event_type_masks(events_df, "Shot", "Pass", "Dribble", "Pressure", "Duel", "Carry")
+    is_aerial = type_mask["Duel"] & event_column(events_df, "duel_type").isin(AERIAL_DUEL_TYPES)
+    conditions = [
+        type_mask["Shot"] & (event_column(events_df, "shot_outcome") == "Goal"),
+        type_mask["Shot"],
+        type_mask["Pass"] & event_column(events_df, "pass_outcome").isna(),
+        type_mask["Pass"],
+        type_mask["Dribble"] & (event_column(events_df, "dribble_outcome") == "Complete"),
+        type_mask["Pressure"] & (event_column(events_df, "counterpress") == True),
+        type_mask["Pressure"],
+        is_aerial & event_column(events_df, "duel_outcome").isin(WON_DUEL_OUTCOMES),
+        is_aerial,
+        type_mask["Carry"],
+    ]
+    codes = [
+        EVENT_GOAL, EVENT_SHOT,
+        EVENT_PASS_COMPLETE, EVENT_PASS,
+        EVENT_DRIBBLE_COMPLETE,
+        EVENT_COUNTERPRESS, EVENT_PRESSURE,
+        EVENT_AERIAL_WON, EVENT_AERIAL,
+        EVENT_CARRY,
+    ]
+    classes = np.select([c.to_numpy(dtype=bool) for c in conditions], codes, default=EVENT_OTHER)
+    return pd.Series(classes.astype(np.int8), index=events_df.index)
+
+
+def carry_distance_by_player(player_ids, start, end):
+    """
+    Sum carry distances per player with a single scatter-add over dense player codes,
+    without materialising a per-event distance column on the full events frame.
+    """
+    codes, uniques = pd.factorize(player_ids)
+    distance = np.hypot(end[:, 0] - start[:, 0], end[:, 1] - start[:, 1])
+    totals = np.bincount(codes, weights=distance, minlength=len(uniques))
+    return pd.Series(totals, index=uniques)
+
+
+def event_type_masks(events_df, *event_types):
+    """Boolean masks for the given event types, built from a single pass over `type`."""
+    type_rows = events_df.groupby("type", observed=True).indices
+    masks = {}
+    for event_type in event_types:
+        mask = np.zeros(len(events_df), dtype=bool)
+        mask[type_rows.get(event_type, [])] = True
+        masks[event_type] = pd.Series(mask, index=events_df.index)
+    return masks
+
+
+@stage_cache("metrics")
 def aggregate_metrics(events_df, minutes_df):
     """
     Aggregate raw event counts per player across all matches.
     Returns a DataFrame with raw counts ready for per-90 conversion.
+    Every metric is tagged per event from `event_class` and summed in a single groupby.
     """
-    players = minutes_df.copy()
+    event_class = events_df["event_class"]
 
     # ── Shots & xG ──
-    shots = events_df[events_df["type"] == "Shot"]
-    shot_counts = shots.groupby("player_id").size().reset_index(name="shots")
-    goals = shots[shots["shot_outcome"] == "Goal"].groupby("player_id").size().reset_index(name="goals")
-    xg = shots.groupby("player_id")["shot_statsbomb_xg"].sum().reset_index(name="total_xg") if "shot_statsbomb_xg" in shots.columns else pd.DataFrame(columns=["player_id", "total_xg"])
+    is_shot = event_class.isin((EVENT_SHOT, EVENT_GOAL))
+    is_goal = event_class == EVENT_GOAL
+    shot_xg = event_column(events_df, "shot_statsbomb_xg").where(is_shot, 0.0).fillna(0.0)
 
     # ── Passes ──
-    passes = events_df[events_df["type"] == "Pass"]
-    total_passes = passes.groupby("player_id").size().reset_index(name="total_passes")
-    completed_passes = passes[passes["pass_outcome"].isna()].groupby("player_id").size().reset_index(name="completed_passes")
+    is_pass = event_class.isin((EVENT_PASS, EVENT_PASS_COMPLETE))
+    is_completed_pass = event_class == EVENT_PASS_COMPLETE
 
     # Progressive passes (passes into the final third)
-    prog_passes = passes[passes["pass_end_location"].notna()].copy()
-    if not prog_passes.empty:
+    pass_end = event_column(events_df, "pass_end_location")
+    is_prog_pass = pd.Series(False, index=events_df.index)
+    prog_candidates = is_pass & pass_end.notna()
+    if prog_candidates.any():
         try:
-            prog_passes["end_x"] = prog_passes["pass_end_location"].apply(
-                lambda loc: loc[0] if isinstance(loc, (list, tuple)) and len(loc) >= 2 else None
-            )
-            prog_passes = prog_passes[prog_passes["end_x"].notna()]
-            prog_passes = prog_passes[prog_passes["end_x"] >= 80]
-            prog_pass_counts = prog_passes.groupby("player_id").size().reset_index(name="prog_passes")
+            end = location_xy(pass_end[prog_candidates])
+            is_prog_pass[prog_candidates] = end[:, 0] >= 80
         except Exception:
-            prog_pass_counts = pd.DataFrame(columns=["player_id", "prog_passes"])
-    else:
-        prog_pass_counts = pd.DataFrame(columns=["player_id", "prog_passes"])
+            pass
 
     # Key passes (passes that led to a shot / goal assist)
-    key_pass_mask = pd.Series(False, index=passes.index)
-    if "pass_goal_assist" in passes.columns:
-        key_pass_mask = key_pass_mask | (passes["pass_goal_assist"] == True)
-    if "pass_shot_assist" in passes.columns:
-        key_pass_mask = key_pass_mask | (passes["pass_shot_assist"] == True)
-    key_passes = passes[key_pass_mask].groupby("player_id").size().reset_index(name="key_passes")
-
-    # ── Dribbles ──
-    dribbles = events_df[events_df["type"] == "Dribble"]
-    successful_dribbles = dribbles[dribbles["dribble_outcome"] == "Complete"]
-    dribble_counts = successful_dribbles.groupby("player_id").size().reset_index(name="dribbles")
-
-    # ── Pressures ──
-    pressures = events_df[events_df["type"] == "Pressure"]
-    pressure_counts = pressures.groupby("player_id").size().reset_index(name="pressures")
-
-    # Press success
-    press_success_counts = pd.DataFrame(columns=["player_id", "press_successes"])
-    if "counterpress" in pressures.columns:
-        press_success_counts = pressures[
-            pressures["counterpress"].fillna(False) == True
-        ].groupby("player_id").size().reset_index(name="press_successes")
-
-    # ── Aerial duels ──
-    aerial_total = pd.DataFrame(columns=["player_id", "aerial_total"])
-    aerial_wins = pd.DataFrame(columns=["player_id", "aerial_wins"])
-    try:
-        duels = events_df[events_df["type"] == "Duel"].copy()
-        if not duels.empty and "duel_type" in duels.columns:
-            aerial_duels = duels[duels["duel_type"].astype(str).str.contains("Aerial", case=False, na=False)]
-            if not aerial_duels.empty:
-                aerial_total = aerial_duels.groupby("player_id").size().reset_index(name="aerial_total")
-                if "duel_outcome" in aerial_duels.columns:
-                    won_mask = aerial_duels["duel_outcome"].astype(str).str.contains("Won|Success", case=False, na=False)
-                    aerial_wins = aerial_duels[won_mask].groupby("player_id").size().reset_index(name="aerial_wins")
-    except Exception:
-        pass
+    is_key_pass = is_pass & (
+        (event_column(events_df, "pass_goal_assist") == True)
+        | (event_column(events_df, "pass_shot_assist") == True)
+    )
+
+    # ── Dribbles, pressures & aerial duels ──
+    is_dribble = event_class == EVENT_DRIBBLE_COMPLETE
+    is_pressure = event_class.isin((EVENT_PRESSURE, EVENT_COUNTERPRESS))
+    is_press_success = event_class == EVENT_COUNTERPRESS
+    is_aerial = event_class.isin((EVENT_AERIAL, EVENT_AERIAL_WON))
+    is_aerial_win = event_class == EVENT_AERIAL_WON
 
     # ── Carries (distance) ──
-    carries = events_df[events_df["type"] == "Carry"]
-    if not carries.empty and "carry_end_location" in carries.columns:
+    carry_distance = pd.Series(dtype=float)
+    is_carry = (
+        (event_class == EVENT_CARRY)
+        & events_df["player_id"].notna()
+        & event_column(events_df, "location").notna()
+        & event_column(events_df, "carry_end_location").notna()
+    )
+    if is_carry.any():
         try:
-            carries = carries.copy()
-            carries["start_x"] = carries["location"].apply(
-                lambda loc: loc[0] if isinstance(loc, (list, tuple)) and len(loc) >= 2 else 0
-            )
-            carries["start_y"] = carries["location"].apply(
-                lambda loc: loc[1] if isinstance(loc, (list, tuple)) and len(loc) >= 2 else 0
-            )
-            carries["end_x"] = carries["carry_end_location"].apply(
-                lambda loc: loc[0] if isinstance(loc, (list, tuple)) and len(loc) >= 2 else 0
+            carry_distance = carry_distance_by_player(
+                events_df.loc[is_carry, "player_id"],
+                location_xy(events_df.loc[is_carry, "location"]),
+                location_xy(events_df.loc[is_carry, "carry_end_location"]),
             )
-            carries["end_y"] = carries["carry_end_location"].apply(
-                lambda loc: loc[1] if isinstance(loc, (list, tuple)) and len(loc) >= 2 else 0
-            )
-            carries["distance"] = ((carries["end_x"] - carries["start_x"]) ** 2 +
-                                   (carries["end_y"] - carries["start_y"]) ** 2) ** 0.5
-            carry_distance = carries.groupby("player_id")["distance"].sum().reset_index(name="carry_distance")
         except Exception:
-            carry_distance = pd.DataFrame(columns=["player_id", "carry_distance"])
-    else:
-        carry_distance = pd.DataFrame(columns=["player_id", "carry_distance"])
-
-    # ── Merge all metrics ──
-    metric_dfs = [
-        shot_counts, goals, xg, total_passes, completed_passes,
-        prog_pass_counts, key_passes, dribble_counts,
-        pressure_counts, press_success_counts,
-        aerial_total, aerial_wins, carry_distance,
-    ]
-    for mdf in metric_dfs:
-        if not mdf.empty:
-            players = players.merge(mdf, on="player_id", how="left")
+            pass
+
+    # ── Single pass over player_id for all metrics ──
+    tagged = pd.DataFrame({
+        "player_id": events_df["player_id"],
+        "is_shot": is_shot.astype(int),
+        "is_goal": is_goal.astype(int),
+        "shot_xg": shot_xg.astype(float),
+        "is_pass": is_pass.astype(int),
+        "is_completed_pass": is_completed_pass.astype(int),
+        "is_prog_pass": is_prog_pass.astype(int),
+        "is_key_pass": is_key_pass.astype(int),
+        "is_dribble": is_dribble.astype(int),
+        "is_pressure": is_pressure.astype(int),
+        "is_press_success": is_press_success.astype(int),
+        "is_aerial": is_aerial.astype(int),
+        "is_aerial_win": is_aerial_win.astype(int),
+    })
+    metrics = tagged.groupby("player_id").agg(
+        shots=("is_shot", "sum"),
+        goals=("is_goal", "sum"),
+        total_xg=("shot_xg", "sum"),
+        total_passes=("is_pass", "sum"),
+        completed_passes=("is_completed_pass", "sum"),
+        prog_passes=("is_prog_pass", "sum"),
+        key_passes=("is_key_pass", "sum"),
+        dribbles=("is_dribble", "sum"),
+        pressures=("is_pressure", "sum"),
+        press_successes=("is_press_success", "sum"),
+        aerial_total=("is_aerial", "sum"),
+        aerial_wins=("is_aerial_win", "sum"),
+    )
+    metrics["carry_distance"] = carry_distance.reindex(metrics.index, fill_value=0.0)
 
-    players = players.fillna(0)
+    # ── Join all metrics on the shared player_id index ──
+    players = minutes_df.join(metrics, on="player_id", how="left")
+    players[metrics.columns] = players[metrics.columns].fillna(0)
     return players
 
 
+def safe_percentage(numerator, denominator):
+    """Element-wise numerator / denominator * 100, with 0 wherever the denominator is 0."""
+    num = numerator.to_numpy(dtype=float)
+    den = denominator.to_numpy(dtype=float)
+    return np.divide(num, den, out=np.zeros_like(num), where=den > 0) * 100
+
+
 def compute_per90_and_normalize(players_df):
     """
     Convert raw counts to per-90 values, then normalise each metric
@@ -281,22 +532,14 @@ def compute_per90_and_normalize(players_df):
     # Per-90 metrics
     df["shots_p90"] = df["shots"] / per90_factor
     df["xg_p90"] = df["total_xg"] / per90_factor
-    df["shot_conversion"] = df.apply(
-        lambda r: (r["goals"] / r["shots"] * 100) if r["shots"] > 0 else 0, axis=1
-    )
+    df["shot_conversion"] = safe_percentage(df["goals"], df["shots"])
     df["prog_passes_p90"] = df["prog_passes"] / per90_factor
-    df["pass_completion"] = df.apply(
-        lambda r: (r["completed_passes"] / r["total_passes"] * 100) if r["total_passes"] > 0 else 0, axis=1
-    )
+    df["pass_completion"] = safe_percentage(df["completed_passes"], df["total_passes"])
     df["key_passes_p90"] = df["key_passes"] / per90_factor
     df["dribbles_p90"] = df["dribbles"] / per90_factor
     df["pressures_p90"] = df["pressures"] / per90_factor
-    df["press_success"] = df.apply(
-        lambda r: (r["press_successes"] / r["pressures"] * 100) if r["pressures"] > 0 else 0, axis=1
-    )
-    df["aerial_win_rate"] = df.apply(
-        lambda r: (r["aerial_wins"] / r["aerial_total"] * 100) if r["aerial_total"] > 0 else 0, axis=1
-    )
+    df["press_success"] = safe_percentage(df["press_successes"], df["pressures"])
+    df["aerial_win_rate"] = safe_percentage(df["aerial_wins"], df["aerial_total"])
     df["distance_p90"] = df["carry_distance"] / per90_factor
 
     # Metrics to normalise (0-100 scale) — per-competition normalization
@@ -307,33 +550,35 @@ def compute_per90_and_normalize(players_df):
         "aerial_win_rate", "distance_p90",
     ]
 
-    for metric in metrics_to_normalize:
-        mn, mx = df[metric].min(), df[metric].max()
-        if mx > mn:
-            df[metric] = ((df[metric] - mn) / (mx - mn) * 100).round(1)
-        else:
-            df[metric] = 50.0  # If all values are the same
+    # Min-max scale every metric column at once; constant columns map to 50
+    values = df[metrics_to_normalize].to_numpy(dtype=np.float64)
+    mn = values.min(axis=0, keepdims=True)
+    rng = values.max(axis=0, keepdims=True) - mn
+    scaled = np.divide(values - mn, rng, out=np.zeros_like(values), where=rng > 0) * 100
+    df[metrics_to_normalize] = np.where(rng > 0, scaled, 50.0).round(1)
 
     return df
 
 
-def derive_position(events_df, player_id):
-    """Derive simplified position (FW/MF/DF/GK) from StatsBomb position data."""
-    player_events = events_df[events_df["player_id"] == player_id]
-    if "position" in player_events.columns:
-        positions = player_events["position"].dropna()
-        if not positions.empty:
-            most_common = positions.mode().iloc[0] if not positions.mode().empty else ""
-            pos_str = str(most_common).lower()
-            if any(kw in pos_str for kw in ["forward", "striker", "wing"]):
-                return "FW"
-            elif any(kw in pos_str for kw in ["midfield", "midfielder"]):
-                return "MF"
-            elif any(kw in pos_str for kw in ["back", "defender", "center back"]):
-                return "DF"
-            elif "keeper" in pos_str or "goalkeeper" in pos_str:
-                return "GK"
-    return "MF"  # default fallback
+def derive_positions(events_df):
+    """
+    Derive simplified positions (FW/MF/DF/GK) from StatsBomb position data.
+    Returns a Series indexed by player_id, based on each player's most common position.
+    """
+    if "position" not in events_df.columns:
+        return pd.Series(dtype=object)
+
+    # Most common position per player (ties resolved alphabetically, like Series.mode)
+    counts = (
+        events_df.dropna(subset=["position"])
+        .groupby(["player_id", "position"], observed=True)
+        .size()
+        .reset_index(name="n")
+        .sort_values(["player_id", "n", "position"], ascending=[True, False, True])
+        .drop_duplicates("player_id")
+    )
+    simplified = counts["position"].astype(str).map(POSITION_GROUPS).fillna("MF")
+    return pd.Series(simplified.to_numpy(), index=counts["player_id"].to_numpy())
 
 
 def format_players(df, events_df, competition_name, season_name, gender, country):
@@ -353,7 +598,7 @@ def format_players(df, events_df, competition_name, season_name, gender, country
     ]
 
     # Derive positions
-    df["position"] = df["player_id"].apply(lambda pid: derive_position(events_df, pid))
+    df["position"] = df["player_id"].map(derive_positions(events_df)).fillna("MF")
 
     # Rename player column
     df = df.rename(columns={"player": "name"})
@@ -383,10 +628,13 @@ def format_players(df, events_df, competition_name, season_name, gender, country
     return records
 
 
-def process_competition_season(comp_row):
+def process_competition_season(comp_row, refresh=frozenset()):
     """
     Process a single competition/season combination through the full pipeline.
-    Returns a list of player dicts, or an empty list on failure.
+    Stages named in `refresh` are recomputed instead of read from the stage cache.
+    Returns (records, complete): the list of player dicts, and whether every
+    match was processed. Incomplete results (errors, failed downloads) are not
+    written to the per-competition cache.
     """
     comp_id = int(comp_row["competition_id"])
     season_id = int(comp_row["season_id"])
@@ -395,13 +643,13 @@ def process_competition_season(comp_row):
     gender = comp_row["competition_gender"]
     country = comp_row.get("country_name", "Unknown")
 
-    cache_file = CACHE_DIR / f"{comp_id}_{season_id}.json"
+    cache_key = competition_cache_key(comp_row)
+    cache_file = CACHE_DIR / f"{results_cache_key(comp_row)}.json"
 
     # Check cache
-    if cache_file.exists():
+    if cache_file.exists() and not refresh:
         print(f"  >> Cache hit: {comp_name} {season_name} ({gender})")
-        with open(cache_file, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return orjson.loads(cache_file.read_bytes()), True
 
     label = f"{comp_name} {season_name} ({gender}, {country})"
     print(f"\n  -> Processing: {label}")
@@ -411,23 +659,33 @@ def process_competition_season(comp_row):
         matches = fetch_matches(comp_id, season_id)
         if matches.empty:
             print(f"    [!] No matches found - skipping.")
-            return []
+            return [], True
         print(f"    Matches: {len(matches)}")
 
         # Step 2: Fetch events
         print(f"    Fetching events for {len(matches)} matches ...")
-        events_df = fetch_all_events(matches)
+        events_df = fetch_all_events(
+            matches, redownload="events" in refresh,
+            cache_key=cache_key, refresh="events" in refresh,
+        )
         if events_df.empty:
             print(f"    [!] No events found - skipping.")
-            return []
+            return [], False
         print(f"    Events: {len(events_df):,}")
 
+        # Stages built on a partial event set are not cached, so they are
+        # recomputed once the missing matches load
+        skipped = events_df.attrs.get("skipped_matches", 0)
+        if skipped:
+            print(f"    [!] {skipped} matches failed to load - not caching this run's stages.")
+        stage_key = None if skipped else cache_key
+
         # Step 3: Calculate minutes
-        minutes_df = calculate_minutes(events_df, matches)
+        minutes_df = calculate_minutes(events_df, matches, cache_key=stage_key, refresh="minutes" in refresh)
         print(f"    Tracked {len(minutes_df)} unique players.")
 
         # Step 4: Aggregate metrics
-        players_df = aggregate_metrics(events_df, minutes_df)
+        players_df = aggregate_metrics(events_df, minutes_df, cache_key=stage_key, refresh="metrics" in refresh)
         print(f"    Aggregated metrics for {len(players_df)} players.")
 
         # Step 5: Per-90 + normalise (per-competition normalization)
@@ -438,10 +696,10 @@ def process_competition_season(comp_row):
         if normalised_df.empty:
             print(f"    [!] No qualifying players - skipping.")
             # Save empty cache to avoid re-processing
-            CACHE_DIR.mkdir(parents=True, exist_ok=True)
-            with open(cache_file, "w", encoding="utf-8") as f:
-                json.dump([], f)
-            return []
+            if not skipped:
+                CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                write_json(cache_file, [])
+            return [], not skipped
 
         # Step 6: Format
         records = format_players(
@@ -451,21 +709,36 @@ def process_competition_season(comp_row):
         print(f"    [OK] {len(records)} players exported.")
 
         # Save to cache
-        CACHE_DIR.mkdir(parents=True, exist_ok=True)
-        with open(cache_file, "w", encoding="utf-8") as f:
-            json.dump(records, f, indent=2, ensure_ascii=False)
+        if not skipped:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            write_json(cache_file, records)
 
-        return records
+        return records, not skipped
 
     except Exception as e:
         print(f"    [ERROR] Error processing {label}: {e}")
-        return []
+        return [], False
 
 
 # ---------------------------------------------
 # MAIN
 # ---------------------------------------------
 def main():
+    parser = argparse.ArgumentParser(description="Build data/players.json from StatsBomb open data.")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild players.json even if the inputs are unchanged")
+    parser.add_argument("--refresh", nargs="*", choices=STAGES, metavar="STAGE",
+                        help="recompute cached stages (%(choices)s; all if none given) "
+                             "and every stage after them; 'events' re-downloads match "
+                             "events from StatsBomb; implies --force")
+    args = parser.parse_args()
+
+    # Refreshing a stage invalidates everything downstream of it
+    refresh = frozenset()
+    if args.refresh is not None:
+        first = min((STAGES.index(stage) for stage in args.refresh), default=0)
+        refresh = frozenset(STAGES[first:])
+
     print("=" * 70)
     print("  xScout Data Pipeline - All StatsBomb Open Data")
     print("  (all competitions, all seasons, male + female)")
@@ -477,7 +750,15 @@ def main():
     # Fetch all available competitions
     comps = fetch_all_competitions()
 
+    # Skip the whole run if players.json was already built from these inputs
+    signature = input_signature(comps)
+    if (not args.force and not refresh and OUTPUT_FILE.exists() and OUTPUT_SIGNATURE.exists()
+            and OUTPUT_SIGNATURE.read_text().strip() == signature):
+        print(f"\n  {OUTPUT_FILE} is up to date (use --force to rebuild).")
+        return
+
     all_players = []
+    incomplete = 0
     total = len(comps)
 
     for idx, (_, row) in enumerate(comps.iterrows()):
@@ -488,21 +769,31 @@ def main():
         print(f"[{idx + 1}/{total}] {comp_name} - {season_name} ({gender})")
         print(f"{'-' * 60}")
 
-        records = process_competition_season(row)
+        records, complete = process_competition_season(row, refresh)
         all_players.extend(records)
+        if not complete:
+            incomplete += 1
         print(f"  Running total: {len(all_players)} players")
 
     # Write final merged JSON
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     all_players.sort(key=lambda p: p.get("name", ""))
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(all_players, f, indent=2, ensure_ascii=False)
+    write_json(OUTPUT_FILE, all_players)
+    pd.DataFrame(all_players).to_parquet(OUTPUT_PARQUET, compression="zstd", index=False)
+    # Only certify the output as up to date if every competition was fully processed
+    if incomplete:
+        OUTPUT_SIGNATURE.unlink(missing_ok=True)
+    else:
+        OUTPUT_SIGNATURE.write_text(signature)
 
     elapsed = time.time() - start_time
     print(f"\n{'=' * 70}")
     print(f"  Pipeline complete!")
     print(f"  Total players: {len(all_players)}")
+    if incomplete:
+        print(f"  [!] {incomplete} competition/season(s) incomplete - they will be retried next run")
     print(f"  Output: {OUTPUT_FILE}")
+    print(f"          {OUTPUT_PARQUET}")
     print(f"  Time elapsed: {elapsed / 60:.1f} minutes")
     print(f"{'=' * 70}")
 